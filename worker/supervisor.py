@@ -0,0 +1,183 @@
+import pika
+import time
+import os
+import math
+import signal
+import subprocess
+import sys
+
+QUEUE_NAME = 'task_queue'
+
+WORKER_MIN = int(os.environ.get('WORKER_MIN', '1'))
+WORKER_MAX = int(os.environ.get('WORKER_MAX', '8'))
+# Wall-clock seconds one worker spends per message (see time.sleep in callback).
+WORKER_MESSAGE_SECONDS = float(os.environ.get('WORKER_MESSAGE_SECONDS', '5'))
+# How long we are willing to let the current backlog take to drain.
+TARGET_DRAIN_SECONDS = float(os.environ.get('TARGET_DRAIN_SECONDS', '60'))
+POLL_INTERVAL = float(os.environ.get('SUPERVISOR_POLL_INTERVAL', '5'))
+# Consecutive low samples required before giving a worker back.
+SCALE_DOWN_SAMPLES = int(os.environ.get('SCALE_DOWN_SAMPLES', '6'))
+# Time workers get to finish their in-flight message on shutdown. Keep it well
+# under the container's stop_grace_period or Docker kills everything first.
+SHUTDOWN_TIMEOUT = float(os.environ.get('SUPERVISOR_SHUTDOWN_TIMEOUT', '20'))
+
+
+def read_queue_stats(channel):
+    """Return (message_count, consumer_count) for the task queue.
+
+    Uses a passive declare, so it never creates or alters the queue. Any
+    object exposing pika's `queue_declare` signature works, which is what
+    lets the supervisor run against an in-process fake broker.
+    """
+    frame = channel.queue_declare(queue=QUEUE_NAME, durable=True, passive=True)
+    return frame.method.message_count, frame.method.consumer_count
+
+
+class Autoscaler:
+    """Turns queue samples into a desired worker count.
+
+    Scale-up is immediate: as soon as the backlog cannot be drained within
+    TARGET_DRAIN_SECONDS at the observed per-worker rate, the count jumps to
+    what is needed. Scale-down is deliberately slow: the desired count must
+    stay below the current one for `scale_down_samples` polls in a row, and
+    then only one worker is released at a time.
+    """
+
+    def __init__(self, minimum=WORKER_MIN, maximum=WORKER_MAX,
+                 message_seconds=WORKER_MESSAGE_SECONDS,
+                 target_drain_seconds=TARGET_DRAIN_SECONDS,
+                 scale_down_samples=SCALE_DOWN_SAMPLES):
+        if minimum < 0 or maximum < max(minimum, 1):
+            raise ValueError(f"Invalid worker bounds: min={minimum} max={maximum}")
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_drain_seconds = target_drain_seconds
+        # Messages/second a single worker gets through; refined from samples.
+        self.worker_rate = 1.0 / message_seconds
+        self.scale_down_samples = scale_down_samples
+        self._low_samples = 0
+        self._last = None
+
+    def _observe(self, message_count, consumer_count, now):
+        if self._last is not None:
+            last_count, last_consumers, last_time = self._last
+            elapsed = now - last_time
+            drained = last_count - message_count
+            # Only a shrinking queue with stable consumers says anything about
+            # per-worker throughput; publishes hide it otherwise, so err slow.
+            if elapsed > 0 and drained > 0 and consumer_count and consumer_count == last_consumers:
+                observed = drained / elapsed / consumer_count
+                self.worker_rate = 0.7 * self.worker_rate + 0.3 * observed
+        self._last = (message_count, consumer_count, now)
+
+    def desired(self, message_count, consumer_count, current, now=None):
+        now = time.monotonic() if now is None else now
+        self._observe(message_count, consumer_count, now)
+
+        needed = math.ceil(message_count / (self.worker_rate * self.target_drain_seconds))
+        needed = min(max(needed, self.minimum), self.maximum)
+
+        if needed >= current:
+            self._low_samples = 0
+            return needed
+
+        self._low_samples += 1
+        if self._low_samples < self.scale_down_samples:
+            return current
+        self._low_samples = 0
+        return current - 1
+
+
+class WorkerPool:
+    """Owns the worker.py child processes.
+
+    Workers being scaled down get SIGTERM and are kept in `draining` until
+    they exit, so the message each one is processing is acked first.
+    """
+
+    def __init__(self, command=None, spawn=subprocess.Popen):
+        here = os.path.dirname(os.path.abspath(__file__))
+        self.command = command or [sys.executable, os.path.join(here, 'worker.py')]
+        self.spawn = spawn
+        self.active = []
+        self.draining = []
+
+    def reap(self):
+        for proc in [p for p in self.active if p.poll() is not None]:
+            print(f"Worker {proc.pid} exited with code {proc.returncode}")
+            self.active.remove(proc)
+        self.draining = [p for p in self.draining if p.poll() is None]
+
+    def scale_to(self, count):
+        self.reap()
+        while len(self.active) < count:
+            proc = self.spawn(self.command)
+            self.active.append(proc)
+            print(f"Started worker {proc.pid} ({len(self.active)} active)")
+        while len(self.active) > count:
+            proc = self.active.pop()
+            proc.send_signal(signal.SIGTERM)
+            self.draining.append(proc)
+            print(f"Draining worker {proc.pid} ({len(self.active)} active)")
+
+    def shutdown(self, timeout=SHUTDOWN_TIMEOUT, clock=time.monotonic):
+        self.scale_to(0)
+        deadline = clock() + timeout
+        for proc in self.draining:
+            try:
+                proc.wait(timeout=max(deadline - clock(), 0))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.draining = []
+
+
+def run(channel, pool, scaler, sleep, should_stop=lambda: False,
+        clock=time.monotonic, poll_interval=POLL_INTERVAL):
+    pool.scale_to(max(len(pool.active), scaler.minimum))
+    while not should_stop():
+        pool.reap()
+        message_count, consumer_count = read_queue_stats(channel)
+        current = len(pool.active)
+        target = scaler.desired(message_count, consumer_count, current, now=clock())
+        if target != current:
+            print(f"Queue depth {message_count}, {consumer_count} consumers: "
+                  f"scaling workers {current} -> {target}")
+        pool.scale_to(target)
+
+        # Sleep in short steps so a stop request is noticed within a second.
+        waited = 0
+        while waited < poll_interval and not should_stop():
+            step = min(1, poll_interval - waited)
+            sleep(step)
+            waited += step
+
+
+def main():
+    rabbit_host = os.environ.get('RABBITMQ_HOST', 'rabbitmq')
+    connection = None
+    while not connection:
+        try:
+            connection = pika.BlockingConnection(pika.ConnectionParameters(host=rabbit_host))
+        except pika.exceptions.AMQPConnectionError:
+            print("RabbitMQ not ready, retrying...")
+            time.sleep(2)
+
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE_NAME, durable=True)
+
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+
+    pool = WorkerPool()
+    scaler = Autoscaler()
+    print(f"Supervisor scaling workers between {scaler.minimum} and {scaler.maximum}")
+    try:
+        # connection.sleep keeps servicing heartbeats between polls.
+        run(channel, pool, scaler, connection.sleep, should_stop=lambda: bool(stopping))
+    finally:
+        print('Supervisor stopping, draining workers...')
+        pool.shutdown()
+        connection.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# worker.py and supervisor.py are scripts, not a package; import them directly.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
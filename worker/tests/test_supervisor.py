@@ -0,0 +1,140 @@
+import signal
+import subprocess
+from types import SimpleNamespace
+
+import supervisor
+
+
+class FakeChannel:
+    """In-process broker: passive declares return scripted queue counts."""
+
+    def __init__(self, samples):
+        self.samples = list(samples)
+        self.declares = []
+
+    def queue_declare(self, queue, durable=False, passive=False):
+        self.declares.append((queue, durable, passive))
+        message_count, consumer_count = self.samples.pop(0)
+        return SimpleNamespace(method=SimpleNamespace(
+            message_count=message_count, consumer_count=consumer_count
+        ))
+
+
+class FakeProcess:
+    """Stands in for a worker.py Popen; exits once it has drained."""
+
+    next_pid = 1
+
+    def __init__(self, command, hangs=False):
+        self.command = command
+        self.pid = FakeProcess.next_pid
+        FakeProcess.next_pid += 1
+        self.returncode = None
+        self.signals = []
+        self.hangs = hangs
+        self.killed = False
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, signum):
+        self.signals.append(signum)
+
+    def wait(self, timeout=None):
+        if self.hangs:
+            raise subprocess.TimeoutExpired(self.command, timeout)
+        self.returncode = 0
+        return 0
+
+    def kill(self):
+        self.killed = True
+        self.returncode = -9
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def run_samples(samples, scaler, pool=None, poll_interval=5):
+    channel = FakeChannel(samples)
+    pool = pool or supervisor.WorkerPool(spawn=FakeProcess)
+    clock = FakeClock()
+    supervisor.run(
+        channel, pool, scaler, clock.sleep,
+        should_stop=lambda: not channel.samples,
+        clock=clock, poll_interval=poll_interval,
+    )
+    return channel, pool
+
+
+def test_queue_stats_use_passive_declare():
+    channel = FakeChannel([(12, 3)])
+    assert supervisor.read_queue_stats(channel) == (12, 3)
+    assert channel.declares == [('task_queue', True, True)]
+
+
+def test_scales_up_to_backlog_and_clamps_to_max():
+    scaler = supervisor.Autoscaler(minimum=1, maximum=4, message_seconds=5,
+                                   target_drain_seconds=60)
+    # 24 messages at 12 per worker per minute needs 2 workers; 1000 needs 84.
+    _, pool = run_samples([(24, 1)], scaler)
+    assert len(pool.active) == 2
+    _, pool = run_samples([(1000, 2)], scaler, pool)
+    assert len(pool.active) == 4
+
+
+def test_scale_down_waits_for_consecutive_low_samples():
+    scaler = supervisor.Autoscaler(minimum=1, maximum=4, message_seconds=5,
+                                   target_drain_seconds=60, scale_down_samples=3)
+    _, pool = run_samples([(1000, 0)], scaler)
+    assert len(pool.active) == 4
+
+    # Two low samples then a spike: the streak resets and nobody is released.
+    _, pool = run_samples([(0, 4), (0, 4), (1000, 4)], scaler, pool)
+    assert len(pool.active) == 4
+    assert pool.draining == []
+
+    # Three in a row releases exactly one worker, via SIGTERM.
+    _, pool = run_samples([(0, 4), (0, 4), (0, 4)], scaler, pool)
+    assert len(pool.active) == 3
+    assert [p.signals for p in pool.draining] == [[signal.SIGTERM]]
+
+
+def test_drain_rate_is_learned_through_run():
+    scaler = supervisor.Autoscaler(minimum=1, maximum=8, message_seconds=5,
+                                   target_drain_seconds=60)
+    # Two consumers drain 20 messages per 5s poll: 2 msg/s each, not 0.2.
+    run_samples([(100, 2), (80, 2), (60, 2)], scaler)
+    assert scaler.worker_rate > 1.0 / 5
+
+
+def test_stop_interrupts_poll_sleep():
+    scaler = supervisor.Autoscaler(minimum=1, maximum=1)
+    channel = FakeChannel([(0, 0)])
+    clock = FakeClock()
+    stop_at = 2
+    supervisor.run(
+        channel, supervisor.WorkerPool(spawn=FakeProcess), scaler, clock.sleep,
+        should_stop=lambda: clock.now >= stop_at, clock=clock, poll_interval=30,
+    )
+    assert clock.now == stop_at
+
+
+def test_shutdown_drains_and_kills_stragglers():
+    spawned = iter([False, True])
+    pool = supervisor.WorkerPool(spawn=lambda cmd: FakeProcess(cmd, hangs=next(spawned)))
+    pool.scale_to(2)
+    clean, stuck = pool.active
+
+    pool.shutdown(timeout=1)
+
+    assert pool.active == [] and pool.draining == []
+    assert clean.signals == [signal.SIGTERM] and clean.returncode == 0
+    assert stuck.signals == [signal.SIGTERM] and stuck.killed
@@ -0,0 +1,130 @@
+import psycopg2
+import pytest
+
+import worker
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def execute(self, query, params=None):
+        if self.conn.fail_next:
+            error, self.conn.fail_next = self.conn.fail_next, None
+            raise error
+        self.conn.queries.append((query, params))
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self):
+        self.queries = []
+        self.closed = 0
+        self.commits = 0
+        self.fail_next = None
+        self.rollback_error = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        if self.rollback_error:
+            raise self.rollback_error
+
+    def close(self):
+        self.closed = 1
+
+    def prepares(self):
+        return [q for q, _ in self.queries if q.startswith('PREPARE')]
+
+
+@pytest.fixture
+def connections(monkeypatch):
+    """Every psycopg2.connect in worker hands out a new FakeConnection."""
+    opened = []
+
+    def connect(**kwargs):
+        opened.append(FakeConnection())
+        return opened[-1]
+
+    monkeypatch.setattr(worker.psycopg2, 'connect', connect)
+    monkeypatch.setattr(worker, '_update_conn', None)
+    monkeypatch.setattr(worker, '_prepared', {})
+    monkeypatch.setattr(worker, '_prepared_stats', {'hits': 0, 'misses': 0})
+    return opened
+
+
+def test_repeated_patch_shape_prepares_once(connections):
+    assert worker.update_record_in_db(1, {'title': 'a', 'description': 'b'})
+    assert worker.update_record_in_db(2, {'description': 'd', 'title': 'c'})
+
+    (conn,) = connections
+    assert conn.prepares() == [
+        'PREPARE update_records_0 AS UPDATE records SET description = $1, title = $2, '
+        'status = $3, updated_at = $4 WHERE id = $5'
+    ]
+    executes = [(q, p) for q, p in conn.queries if q.startswith('EXECUTE')]
+    assert [p[:3] + p[4:] for _, p in executes] == [
+        ['b', 'a', 'completed', 1],
+        ['d', 'c', 'completed', 2],
+    ]
+    assert worker._prepared_stats == {'hits': 1, 'misses': 1}
+    assert conn.commits == 2
+
+
+def test_columns_outside_whitelist_never_reach_sql(connections):
+    assert worker.update_record_in_db(1, {'title': 'a', 'owner_id = 1; --': 'x'})
+
+    (conn,) = connections
+    assert 'owner_id' not in ' '.join(q for q, _ in conn.queries)
+    assert conn.prepares() == [
+        'PREPARE update_records_0 AS UPDATE records SET title = $1, '
+        'status = $2, updated_at = $3 WHERE id = $4'
+    ]
+
+
+def test_raw_password_hash_is_rejected(connections):
+    assert worker.update_user_in_db(1, {'password_hash': 'forged'})
+    assert worker.update_user_in_db(1, {'password': 'secret'})
+
+    (conn,) = connections
+    params = [p for q, p in conn.queries if q.startswith('EXECUTE')]
+    assert 'forged' not in params[0] + params[1]
+    assert params[1][0] not in ('secret', 'forged')
+    assert conn.prepares()[0].startswith('PREPARE update_users_0 AS UPDATE users SET updated_at = $1')
+
+
+def test_reconnect_clears_prepared_cache(connections):
+    assert worker.update_record_in_db(1, {'title': 'a'})
+    connections[0].closed = 1
+    assert worker.update_record_in_db(1, {'title': 'a'})
+
+    assert len(connections) == 2
+    assert len(connections[0].prepares()) == 1
+    assert len(connections[1].prepares()) == 1
+
+
+def test_dropped_connection_is_retried_once(connections):
+    assert worker.update_record_in_db(1, {'title': 'a'})
+    connections[0].fail_next = psycopg2.OperationalError('server closed the connection')
+
+    assert worker.update_record_in_db(2, {'title': 'b'})
+    assert connections[0].closed
+    assert len(connections) == 2
+    assert connections[1].commits == 1
+
+
+def test_failed_rollback_drops_connection(connections):
+    assert worker.update_record_in_db(1, {'title': 'a'})
+    conn = connections[0]
+    conn.fail_next = psycopg2.DataError('value too long')
+    conn.rollback_error = psycopg2.InterfaceError('connection already closed')
+
+    assert worker.update_record_in_db(2, {'title': 'x' * 300}) is False
+    assert worker._update_conn is None
+    assert conn.closed
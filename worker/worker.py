@@ -2,6 +2,7 @@ import pika
 import time
 import os
 import json
+import signal
 import psycopg2
 
 DB_USER = os.environ.get('POSTGRES_USER', 'admin')
@@ -11,6 +12,118 @@ DB_NAME = os.environ.get('POSTGRES_DB', 'appdb')
 
 from datetime import datetime
 
+# Columns a message patch may set, per table. Anything else is dropped before
+# it can reach the SQL text.
+UPDATE_COLUMNS = {
+    'records': ('title', 'description'),
+    'users': ('email', 'role', 'is_active', 'password_hash'),
+}
+STATS_LOG_EVERY = 100
+
+# UPDATEs run on one long-lived connection so their server-side prepared
+# statements (which live as long as the session) can be reused across
+# messages. Keyed by (table, sorted patched columns) -> statement name.
+_update_conn = None
+_prepared = {}
+_prepared_stats = {'hits': 0, 'misses': 0}
+
+def get_update_connection():
+    global _update_conn
+    if _update_conn is None or _update_conn.closed:
+        _update_conn = psycopg2.connect(
+            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST
+        )
+        # A new session has no prepared statements.
+        _prepared.clear()
+    return _update_conn
+
+CONNECTION_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+def drop_update_connection():
+    global _update_conn
+    if _update_conn is not None:
+        try:
+            _update_conn.close()
+        except Exception:
+            pass
+    _update_conn = None
+
+def reset_update_connection(error):
+    if _update_conn is None or _update_conn.closed:
+        drop_update_connection()
+        return
+    if isinstance(error, CONNECTION_ERRORS):
+        drop_update_connection()
+        return
+    try:
+        _update_conn.rollback()
+    except Exception:
+        # The session is unusable; start over with a fresh one.
+        drop_update_connection()
+
+def log_prepared_stats():
+    hits, misses = _prepared_stats['hits'], _prepared_stats['misses']
+    total = hits + misses
+    rate = 100.0 * hits / total if total else 0.0
+    print(f"Prepared UPDATE cache: {hits} hits, {misses} misses ({rate:.1f}% hit rate), "
+          f"{len(_prepared)} statements")
+
+def execute_prepared_update(cur, table, row_id, patch, always):
+    """UPDATE one row of `table` through a cached prepared statement.
+
+    `patch` is filtered through UPDATE_COLUMNS; `always` holds the columns
+    every update of this table sets (e.g. updated_at) and must keep the same
+    keys from call to call.
+    """
+    allowed = UPDATE_COLUMNS[table]
+    rejected = sorted(k for k in patch if k not in allowed)
+    if rejected:
+        print(f"Ignoring non-updatable {table} columns: {', '.join(rejected)}")
+    columns = tuple(sorted(k for k in patch if k in allowed))
+
+    key = (table, columns)
+    name = _prepared.get(key)
+    if name is None:
+        _prepared_stats['misses'] += 1
+        name = f"update_{table}_{len(_prepared)}"
+        set_columns = columns + tuple(always)
+        set_clause = ', '.join(f"{col} = ${i}" for i, col in enumerate(set_columns, 1))
+        cur.execute(
+            f"PREPARE {name} AS UPDATE {table} SET {set_clause} WHERE id = ${len(set_columns) + 1}"
+        )
+        _prepared[key] = name
+    else:
+        _prepared_stats['hits'] += 1
+
+    params = [patch[col] for col in columns] + list(always.values()) + [row_id]
+    cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+    if (_prepared_stats['hits'] + _prepared_stats['misses']) % STATS_LOG_EVERY == 0:
+        log_prepared_stats()
+
+def run_prepared_update(table, row_id, patch, always):
+    """Run execute_prepared_update and commit on the shared connection.
+
+    A dropped connection (Postgres restart, idle timeout) is retried once on a
+    fresh one, so the message is not acked with its update lost.
+    """
+    for attempt in (1, 2):
+        try:
+            conn = get_update_connection()
+            cur = conn.cursor()
+            execute_prepared_update(cur, table, row_id, patch, always)
+            conn.commit()
+            cur.close()
+            return
+        except CONNECTION_ERRORS as e:
+            reset_update_connection(e)
+            if attempt == 2:
+                raise
+            print(f"Update connection lost ({e}), reconnecting...")
+        except Exception as e:
+            reset_update_connection(e)
+            raise
+
 def create_record_in_db(owner_id, title, description):
     try:
         conn = psycopg2.connect(
@@ -34,30 +147,10 @@ def create_record_in_db(owner_id, title, description):
 
 def update_record_in_db(record_id, patch):
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST
+        run_prepared_update(
+            'records', record_id, patch,
+            {'status': 'completed', 'updated_at': datetime.utcnow()}
         )
-        cur = conn.cursor()
-        
-        # Build dynamic UPDATE query
-        set_clause = []
-        params = []
-        for key, value in patch.items():
-            set_clause.append(f"{key} = %s")
-            params.append(value)
-        
-        set_clause.append("status = %s")
-        params.append('completed')
-        set_clause.append("updated_at = %s")
-        params.append(datetime.utcnow())
-        
-        params.append(record_id)
-        
-        query = f"UPDATE records SET {', '.join(set_clause)} WHERE id = %s"
-        cur.execute(query, params)
-        conn.commit()
-        cur.close()
-        conn.close()
         return True
     except Exception as e:
         print(f"Error updating record in DB: {e}")
@@ -121,31 +214,18 @@ def create_user_in_db(user_data):
 
 def update_user_in_db(user_id, patch):
     try:
-        conn = psycopg2.connect(
-            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD, host=DB_HOST
+        patch = dict(patch)
+        # Only a plaintext password may set the hash; never accept a raw one.
+        if 'password_hash' in patch:
+            del patch['password_hash']
+            print("Ignoring raw password_hash in user patch")
+        if 'password' in patch:
+            patch['password_hash'] = generate_password_hash(patch.pop('password'))
+
+        run_prepared_update(
+            'users', user_id, patch,
+            {'updated_at': datetime.utcnow()}
         )
-        cur = conn.cursor()
-        
-        set_clause = []
-        params = []
-        for key, value in patch.items():
-            if key == 'password':
-                set_clause.append("password_hash = %s")
-                params.append(generate_password_hash(value))
-            else:
-                set_clause.append(f"{key} = %s")
-                params.append(value)
-        
-        set_clause.append("updated_at = %s")
-        params.append(datetime.utcnow())
-        
-        params.append(user_id)
-        
-        query = f"UPDATE users SET {', '.join(set_clause)} WHERE id = %s"
-        cur.execute(query, params)
-        conn.commit()
-        cur.close()
-        conn.close()
         return True
     except Exception as e:
         print(f"Error updating user in DB: {e}")
@@ -208,10 +288,23 @@ def main():
     channel = connection.channel()
     channel.queue_declare(queue='task_queue', durable=True)
     channel.basic_qos(prefetch_count=1)
-    channel.basic_consume(queue='task_queue', on_message_callback=callback)
+    consumer_tag = channel.basic_consume(queue='task_queue', on_message_callback=callback)
+
+    # SIGTERM only raises a flag: the message currently in `callback` is
+    # finished and acked before the consume loop notices and exits.
+    stopping = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
 
     print('Worker waiting for messages...')
-    channel.start_consuming()
+    while not stopping:
+        connection.process_data_events(time_limit=1)
+
+    print('Worker draining, shutting down...')
+    channel.basic_cancel(consumer_tag)
+    connection.close()
+    log_prepared_stats()
+    if _update_conn is not None and not _update_conn.closed:
+        _update_conn.close()
 
 if __name__ == '__main__':
     main()